@@ -4,9 +4,136 @@ Loads credentials from environment variables or .env file.
 """
 from google.cloud import bigquery
 from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+import functools
+import logging
 import os
+import threading
 from pathlib import Path
-from dotenv import load_dotenv
+from dotenv import dotenv_values
+
+# The Storage Read API client and pyarrow are optional - without them results are read over REST
+try:
+    from google.cloud import bigquery_storage_v1
+    import pyarrow  # noqa: F401
+except ImportError:
+    bigquery_storage_v1 = None
+
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+# Size of the HTTP connection pool shared by concurrent BigQuery requests
+HTTP_POOL_SIZE = 32
+
+
+# Location of the .env file with the BigQuery credentials
+_ENV_PATH = Path(__file__).parent / ".env"
+
+# Credential settings resolved from the .env file and process environment,
+# rebuilt only when the .env file's modification time changes
+_ENV_SNAPSHOT = None
+_env_snapshot_mtime = None
+
+
+def _env_mtime():
+    """Return the .env file's modification time, or None if there is no .env file."""
+    try:
+        return _ENV_PATH.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _read_env_snapshot() -> dict:
+    """
+    Resolve every credential setting once, GCP_ prefixed names first, then fallbacks.
+    Process environment variables take precedence over the .env file.
+    
+    Returns:
+        dict: Credential settings (None when not set)
+    """
+    # dotenv_values() returns an empty dict when the .env file does not exist
+    env = {**dotenv_values(_ENV_PATH), **os.environ}
+    
+    def first(*names, default=None):
+        for name in names:
+            if env.get(name):
+                return env[name]
+        return default
+    
+    return {
+        "credentials_json": first("CREDENTIALS_JSON"),
+        "credentials_path": first("CREDENTIALS_PATH"),
+        "project_id": first("GCP_PROJECT_ID", "PROJECT_ID", "BIGQUERY_PROJECT"),
+        "client_email": first("GCP_CLIENT_EMAIL", "CLIENT_EMAIL"),
+        "private_key": first("GCP_PRIVATE_KEY", "PRIVATE_KEY"),
+        "private_key_id": first("GCP_PRIVATE_KEY_ID", "PRIVATE_KEY_ID"),
+        "client_id": first("GCP_CLIENT_ID", "CLIENT_ID"),
+        "auth_uri": first("GCP_AUTH_URI", "AUTH_URI", default="https://accounts.google.com/o/oauth2/auth"),
+        "token_uri": first("GCP_TOKEN_URI", "TOKEN_URI", default="https://oauth2.googleapis.com/token"),
+        "auth_provider_x509_cert_url": first(
+            "GCP_AUTH_PROVIDER_X509_CERT_URL", "GCP_auth_provider_x509_cert_url", "AUTH_PROVIDER_X509_CERT_URL",
+            default="https://www.googleapis.com/oauth2/v1/certs"
+        ),
+        "client_x509_cert_url": first("GCP_CLIENT_X509_CERT_URL", "CLIENT_X509_CERT_URL"),
+        "universe_domain": first("GCP_UNIVERSE_DOMAIN", "UNIVERSE_DOMAIN", default="googleapis.com"),
+        "location": first("GCP_LOCATION", "BIGQUERY_LOCATION"),
+    }
+
+
+def _refresh_env_snapshot(env_mtime) -> dict:
+    """Return the credential settings, re-reading the .env file only if it changed."""
+    global _ENV_SNAPSHOT, _env_snapshot_mtime
+    if _ENV_SNAPSHOT is None or env_mtime != _env_snapshot_mtime:
+        _ENV_SNAPSHOT = _read_env_snapshot()
+        _env_snapshot_mtime = env_mtime
+        if env_mtime is not None:
+            logger.debug("Loaded .env file from: %s", _ENV_PATH)
+    return _ENV_SNAPSHOT
+
+
+def _build_credentials_info(settings: dict) -> dict:
+    """
+    Build the service account info dictionary from resolved credential settings.
+    
+    Args:
+        settings: Credential settings from _read_env_snapshot
+    
+    Returns:
+        dict: Service account info accepted by Credentials.from_service_account_info
+    """
+    if not settings["project_id"]:
+        raise ValueError(f"GCP_PROJECT_ID must be set in {_ENV_PATH} or the environment")
+    if not settings["client_email"]:
+        raise ValueError(f"GCP_CLIENT_EMAIL must be set in {_ENV_PATH} or the environment")
+    if not settings["private_key"]:
+        raise ValueError(f"GCP_PRIVATE_KEY must be set in {_ENV_PATH} or the environment")
+    
+    # Build credentials dictionary
+    # Replace \\n with actual newlines in private key (for .env file format)
+    credentials_info = {
+        "type": "service_account",
+        "project_id": settings["project_id"],
+        "private_key": settings["private_key"].replace('\\n', '\n'),
+        "client_email": settings["client_email"],
+    }
+    
+    # Optional variables
+    for key in ("private_key_id", "client_id"):
+        if settings[key]:
+            credentials_info[key] = settings[key]
+    
+    credentials_info["auth_uri"] = settings["auth_uri"]
+    credentials_info["token_uri"] = settings["token_uri"]
+    credentials_info["auth_provider_x509_cert_url"] = settings["auth_provider_x509_cert_url"]
+    
+    if settings["client_x509_cert_url"]:
+        credentials_info["client_x509_cert_url"] = settings["client_x509_cert_url"]
+    
+    credentials_info["universe_domain"] = settings["universe_domain"]
+    return credentials_info
 
 
 def load_credentials():
@@ -30,97 +157,65 @@ def load_credentials():
     
     Alternative: CREDENTIALS_JSON (full JSON as string) or CREDENTIALS_PATH (path to JSON file)
     
+    Variables set in the process environment take precedence over the .env file,
+    and the .env file may be omitted if they provide all required settings.
+    The result is cached until the .env file's modification time changes.
+    
     Returns:
         service_account.Credentials: Authenticated credentials
     """
-    # Load environment variables from .env file
-    env_path = Path(__file__).parent / ".env"
-    if not env_path.exists():
-        raise FileNotFoundError(
-            f".env file not found at {env_path}. Please create .env file with required credentials."
-        )
-    
-    load_dotenv(env_path)
-    print(f"Loaded .env file from: {env_path}")
+    return _load_credentials(_env_mtime())
+
+
+@functools.lru_cache(maxsize=1)
+def _load_credentials(env_mtime):
+    """Load credentials for the given .env modification time (see load_credentials)."""
+    settings = _refresh_env_snapshot(env_mtime)
     
     # Check if full JSON is provided as string
-    if os.getenv("CREDENTIALS_JSON"):
+    if settings["credentials_json"]:
         import json
-        print("Loading credentials from CREDENTIALS_JSON environment variable")
-        credentials_json = json.loads(os.getenv("CREDENTIALS_JSON"))
+        logger.debug("Loading credentials from CREDENTIALS_JSON environment variable")
+        credentials_json = json.loads(settings["credentials_json"])
         credentials = service_account.Credentials.from_service_account_info(credentials_json)
-        print(f"Credentials loaded successfully from CREDENTIALS_JSON")
+        logger.debug("Credentials loaded successfully from CREDENTIALS_JSON")
         return credentials
     
     # Check if path to JSON file is provided
-    credentials_path = os.getenv("CREDENTIALS_PATH")
+    credentials_path = settings["credentials_path"]
     if credentials_path:
         if not os.path.isabs(credentials_path):
-            credentials_path = str(Path(__file__).parent / credentials_path)
+            credentials_path = str(_ENV_PATH.parent / credentials_path)
         
         if not os.path.exists(credentials_path):
             raise FileNotFoundError(f"Credentials file not found: {credentials_path}")
         
-        print(f"Loading credentials from file: {credentials_path}")
+        logger.debug("Loading credentials from file: %s", credentials_path)
         credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        print(f"Credentials loaded successfully from file")
+        logger.debug("Credentials loaded successfully from file")
         return credentials
     
     # Build credentials from individual .env variables (with GCP_ prefix)
-    print("Constructing credentials from .env variables")
-    
-    # Required variables - check GCP_ prefix first, then fallback to old names
-    project_id = os.getenv("GCP_PROJECT_ID") or os.getenv("PROJECT_ID") or os.getenv("BIGQUERY_PROJECT")
-    client_email = os.getenv("GCP_CLIENT_EMAIL") or os.getenv("CLIENT_EMAIL")
-    private_key = os.getenv("GCP_PRIVATE_KEY") or os.getenv("PRIVATE_KEY")
-    
-    if not project_id:
-        raise ValueError("GCP_PROJECT_ID must be set in .env file")
-    if not client_email:
-        raise ValueError("GCP_CLIENT_EMAIL must be set in .env file")
-    if not private_key:
-        raise ValueError("GCP_PRIVATE_KEY must be set in .env file")
-    
-    # Replace \\n with actual newlines in private key (for .env file format)
-    private_key = private_key.replace('\\n', '\n')
-    
-    # Build credentials dictionary
-    credentials_info = {
-        "type": "service_account",
-        "project_id": project_id,
-        "private_key": private_key,
-        "client_email": client_email,
-    }
-    
-    # Optional variables - check GCP_ prefix first, then fallback
-    private_key_id = os.getenv("GCP_PRIVATE_KEY_ID") or os.getenv("PRIVATE_KEY_ID")
-    if private_key_id:
-        credentials_info["private_key_id"] = private_key_id
-    
-    client_id = os.getenv("GCP_CLIENT_ID") or os.getenv("CLIENT_ID")
-    if client_id:
-        credentials_info["client_id"] = client_id
-    
-    credentials_info["auth_uri"] = os.getenv("GCP_AUTH_URI") or os.getenv("AUTH_URI", "https://accounts.google.com/o/oauth2/auth")
-    credentials_info["token_uri"] = os.getenv("GCP_TOKEN_URI") or os.getenv("TOKEN_URI", "https://oauth2.googleapis.com/token")
-    credentials_info["auth_provider_x509_cert_url"] = os.getenv(
-        "GCP_AUTH_PROVIDER_X509_CERT_URL") or os.getenv("GCP_auth_provider_x509_cert_url") or os.getenv(
-        "AUTH_PROVIDER_X509_CERT_URL", 
-        "https://www.googleapis.com/oauth2/v1/certs"
-    )
-    
-    client_x509_cert_url = os.getenv("GCP_CLIENT_X509_CERT_URL") or os.getenv("CLIENT_X509_CERT_URL")
-    if client_x509_cert_url:
-        credentials_info["client_x509_cert_url"] = client_x509_cert_url
-    
-    credentials_info["universe_domain"] = os.getenv("GCP_UNIVERSE_DOMAIN") or os.getenv("UNIVERSE_DOMAIN", "googleapis.com")
-    
-    # Create credentials from the dictionary
-    credentials = service_account.Credentials.from_service_account_info(credentials_info)
-    print(f"Credentials loaded successfully from .env variables")
+    logger.debug("Constructing credentials from .env variables")
+    credentials_info = _build_credentials_info(settings)
+    return _credentials_from_info(tuple(sorted(credentials_info.items())))
+
+
+@functools.lru_cache(maxsize=1)
+def _credentials_from_info(credentials_items: tuple):
+    """
+    Create credentials from service account info items.
+    Cached so that touching the .env file without changing it keeps the parsed key.
+    """
+    credentials = service_account.Credentials.from_service_account_info(dict(credentials_items))
+    logger.debug("Credentials loaded successfully from .env variables")
     return credentials
 
 
+# Read the .env file once at import so the first request only has to stat it
+_refresh_env_snapshot(_env_mtime())
+
+
 def get_bigquery_client():
     """
     Initialize and return a BigQuery client.
@@ -131,25 +226,35 @@ def get_bigquery_client():
     """
     credentials = load_credentials()
     
-    # Get project ID from .env (already loaded in load_credentials)
+    # Get project ID from .env (already resolved in load_credentials)
     # Priority: GCP_PROJECT_ID > PROJECT_ID > BIGQUERY_PROJECT > default
-    env_path = Path(__file__).parent / ".env"
-    if env_path.exists():
-        load_dotenv(env_path)
+    project_id = _ENV_SNAPSHOT["project_id"] or "iucc-f4d"
     
-    project_id = os.getenv("GCP_PROJECT_ID") or os.getenv("PROJECT_ID") or os.getenv("BIGQUERY_PROJECT") or "iucc-f4d"
-    
-    print(f"Initializing BigQuery client with project: {project_id}")
+    logger.debug("Initializing BigQuery client with project: %s", project_id)
     if hasattr(credentials, 'service_account_email'):
-        print(f"Using credentials from service account: {credentials.service_account_email}")
+        logger.debug("Using credentials from service account: %s", credentials.service_account_email)
+    
+    # Share one pooled, authorized HTTP session so concurrent requests reuse
+    # open TLS connections instead of queueing on the default pool of 10
+    http = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    http.mount("https://", adapter)
     
-    # Initialize BigQuery client with credentials and project
-    client = bigquery.Client(credentials=credentials, project=project_id)
+    # Initialize BigQuery client with credentials, project and default job location.
+    # Passing the location saves BigQuery from looking it up for every job; without
+    # GCP_LOCATION it stays None and BigQuery resolves the location itself.
+    client = bigquery.Client(
+        credentials=credentials,
+        project=project_id,
+        location=_ENV_SNAPSHOT["location"],
+        _http=http
+    )
     return client
 
 
 # Global client instance (lazy loaded)
 _bq_client = None
+_bq_client_lock = threading.Lock()
 
 
 def get_client():
@@ -160,7 +265,34 @@ def get_client():
         bigquery.Client: BigQuery client
     """
     global _bq_client
+    # Called from worker threads - lock so concurrent first requests build one client
     if _bq_client is None:
-        _bq_client = get_bigquery_client()
+        with _bq_client_lock:
+            if _bq_client is None:
+                _bq_client = get_bigquery_client()
     return _bq_client
 
+
+
+# Global BigQuery Storage Read API client instance (lazy loaded)
+_bqstorage_client = None
+_bqstorage_client_lock = threading.Lock()
+
+
+def get_bqstorage_client():
+    """
+    Get or create the global BigQuery Storage Read API client instance.
+    Used to download query results over gRPC as Arrow instead of paging through REST.
+    
+    Returns:
+        bigquery_storage_v1.BigQueryReadClient: BigQuery Storage client,
+        or None if google-cloud-bigquery-storage or pyarrow is not installed
+    """
+    global _bqstorage_client
+    if bigquery_storage_v1 is None:
+        return None
+    if _bqstorage_client is None:
+        with _bqstorage_client_lock:
+            if _bqstorage_client is None:
+                _bqstorage_client = bigquery_storage_v1.BigQueryReadClient(credentials=load_credentials())
+    return _bqstorage_client
@@ -2,20 +2,29 @@
 BigQuery GET endpoints for querying tables.
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from google.cloud import bigquery
 from google.cloud.exceptions import GoogleCloudError
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import Forbidden, NotFound, PermissionDenied
+from cachetools import TTLCache
+from collections import defaultdict
+from decimal import Decimal
+import asyncio
+import functools
+import orjson
+import re
 import sys
 import logging
+import threading
 import time
 from pathlib import Path
 
-# Add project root to path to import auth module
-project_root = Path(__file__).parent.parent.parent
-if str(project_root) not in sys.path:
-    sys.path.insert(0, str(project_root))
+# Add project root to path to import auth module (only needed when not started from the project root)
+_PROJECT_ROOT = str(Path(__file__).parents[2])
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
 
-from auth.bigquery_config import get_client
+from auth.bigquery_config import get_client, get_bqstorage_client
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -25,10 +34,230 @@ router = APIRouter()
 # Constant project ID
 PROJECT_ID = "iucc-f4d"
 
+# Allowed characters in dataset and table names interpolated into SQL
+_DATASET_NAME_RE = re.compile(r"\w+")
+_TABLE_NAME_RE = re.compile(r"[\w-]+")
+
+# LLA validation results keyed by (hostname, mac_address, LLA).
+# Metadata changes slowly, so repeated pings from the same sensor are answered from memory.
+LLA_CACHE_MAXSIZE = 10000
+LLA_CACHE_TTL_SECONDS = 300
+_lla_cache = TTLCache(maxsize=LLA_CACHE_MAXSIZE, ttl=LLA_CACHE_TTL_SECONDS)
+
+# Per-key locks so concurrent validations of the same sensor share one BigQuery query.
+# Each entry is [lock, number of requests holding or waiting for it]; it is removed
+# when the last of them is done.
+_lla_locks = {}
+
+# Query templates - only the backtick-quoted table identifier is filled in per table,
+# everything that varies per request is passed as a query parameter.
+# EXISTS lets BigQuery stop at the first matching record instead of counting all of them
+_VALIDATE_LLA_SQL_TMPL = """
+SELECT EXISTS(
+  SELECT 1
+  FROM `{table}`
+  WHERE Owner = @hostname
+    AND Mac_Address = @mac_address
+    AND LLA = @LLA
+) AS has_match
+"""
+
+# Several LLAs for the same table are resolved with one query
+_VALIDATE_LLAS_SQL_TMPL = """
+SELECT DISTINCT LLA
+FROM `{table}`
+WHERE Owner = @hostname
+  AND Mac_Address = @mac_address
+  AND LLA IN UNNEST(@llas)
+"""
+
+_METADATA_PAGE_SQL_TMPL = """
+SELECT *
+FROM `{table}`
+LIMIT @limit
+OFFSET @offset
+"""
+
+# Rows fetched per page when streaming a metadata table
+STREAM_PAGE_SIZE = 1000
+
+# Metadata tables a query found to be missing, keyed by full table name. They are
+# answered without a BigQuery round-trip until the entry expires or is cleared.
+TABLE_CACHE_MAXSIZE = 5000
+TABLE_CACHE_TTL_SECONDS = 600
+_table_missing_cache = TTLCache(maxsize=TABLE_CACHE_MAXSIZE, ttl=TABLE_CACHE_TTL_SECONDS)
+_table_missing_lock = threading.Lock()
+
+# Micro-batching of LLA validations: queued requests for the same metadata table
+# are resolved with a single query instead of one BigQuery job each
+BATCH_MAX = 64
+BATCH_WAIT_MS = 50
+# Upper bound on how long a validation waits for its batch to be resolved
+BATCH_RESULT_TIMEOUT_SECONDS = 60
+# The queue and worker belong to the event loop that created them
+_batch_loop = None
+_batch_queue = None
+_batch_worker = None
+_batch_tasks = set()
+
+
+@router.on_event("startup")
+async def warm_up_client():
+    """Create the BigQuery clients at startup so the first request does not pay for them."""
+    start = time.time()
+    try:
+        get_client()
+        get_bqstorage_client()
+    except Exception as e:
+        # Do not block startup - get_client() will retry on the first request
+        logger.warning(
+            f"[STARTUP] BigQuery client warm-up failed | "
+            f"Error: {str(e)}"
+        )
+        return
+    logger.info(f"[STARTUP] BigQuery client ready | Duration: {time.time() - start:.3f}s")
+
+
+def _full_table_name(dataset: str, table: str) -> str:
+    """
+    Construct full table identifier: project.dataset.table
+    
+    Table identifiers cannot be query parameters, so the names are validated
+    before they are placed inside the backtick-quoted identifier.
+    
+    Raises:
+        ValueError: If dataset or table is not a valid BigQuery name
+    """
+    if not isinstance(dataset, str):
+        raise ValueError(f"Invalid dataset name: {dataset!r}")
+    if not isinstance(table, str):
+        raise ValueError(f"Invalid table name: {table!r}")
+    if not _DATASET_NAME_RE.fullmatch(dataset):
+        raise ValueError(f"Invalid dataset name: {dataset}")
+    if not _TABLE_NAME_RE.fullmatch(table):
+        raise ValueError(f"Invalid table name: {table}")
+    return f"{PROJECT_ID}.{dataset}.{table}"
+
+
+def _table_known_missing(full_table_name: str) -> bool:
+    """Return True if a recent query found that the table does not exist."""
+    with _table_missing_lock:
+        return full_table_name in _table_missing_cache
+
+
+def _mark_table_missing(full_table_name: str):
+    """
+    Record that a query found the table missing. An existing entry is left as is,
+    so repeated lookups do not restart its TTL.
+    """
+    with _table_missing_lock:
+        if full_table_name not in _table_missing_cache:
+            _table_missing_cache[full_table_name] = True
+
+
+@functools.lru_cache(maxsize=1024)
+def _sql_for(template: str, full_table_name: str) -> str:
+    """Render a query template for a table, caching the result per table."""
+    return template.format(table=full_table_name)
+
 
 async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict:
     """
     Validate if LLA exists in metadata table for the given hostname and MAC address.
+    Results without errors are cached for LLA_CACHE_TTL_SECONDS.
+    
+    Args:
+        hostname: Owner/hostname (e.g., "f4d_test")
+        mac_address: MAC address (e.g., "aaaaaaaaaaaa")
+        LLA: LLA value to validate (e.g., "fd002124b00ccf7399b")
+    
+    Returns:
+        dict: Validation result (see _validate_lla_group)
+    """
+    # Payload values come straight from WebSocket JSON and may be numbers, lists or objects
+    if not all(isinstance(value, str) for value in (hostname, mac_address, LLA)):
+        logger.warning(
+            f"[VALIDATE_SENSOR_LLA] Invalid payload types | "
+            f"Hostname: {hostname!r} | "
+            f"MAC: {mac_address!r} | "
+            f"LLA: {LLA!r}"
+        )
+        return {
+            "is_valid": False,
+            "message": "Validation failed",
+            "error": "hostname, mac_address and LLA must be strings"
+        }
+    
+    key = (hostname, mac_address, LLA)
+    
+    cached = _lla_cache.get(key)
+    if cached is not None:
+        logger.debug(f"[VALIDATE_SENSOR_LLA] Cache hit | Hostname: {hostname} | MAC: {mac_address} | LLA: {LLA}")
+        return dict(cached)
+    
+    entry = _lla_locks.get(key)
+    if entry is None:
+        entry = _lla_locks[key] = [asyncio.Lock(), 0]
+    lock = entry[0]
+    entry[1] += 1
+    try:
+        async with lock:
+            # Another request may have filled the cache while we were waiting
+            cached = _lla_cache.get(key)
+            if cached is not None:
+                logger.debug(f"[VALIDATE_SENSOR_LLA] Cache hit | Hostname: {hostname} | MAC: {mac_address} | LLA: {LLA}")
+                return dict(cached)
+            
+            result = await _submit_to_batcher(hostname, mac_address, LLA)
+            
+            # Only cache definitive answers - errors are retried on the next ping
+            if result["error"] is None:
+                _lla_cache[key] = result
+            return dict(result)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _lla_locks[key]
+
+
+def _ensure_batcher() -> asyncio.Queue:
+    """
+    Return the batch queue of the running event loop, starting its worker if needed.
+    A new event loop (e.g. a new server or test client session) gets a new queue and worker.
+    """
+    global _batch_loop, _batch_queue, _batch_worker
+    loop = asyncio.get_running_loop()
+    if _batch_loop is not loop:
+        _batch_loop = loop
+        _batch_queue = asyncio.Queue()
+        _batch_worker = None
+    if _batch_worker is None or _batch_worker.done():
+        _batch_worker = asyncio.create_task(_run_batcher(_batch_queue))
+    return _batch_queue
+
+
+@router.on_event("startup")
+async def start_batcher():
+    """Start the LLA validation batcher on the server's event loop."""
+    _ensure_batcher()
+
+
+@router.on_event("shutdown")
+async def stop_batcher():
+    """Stop the LLA validation batcher, failing any validations still queued."""
+    global _batch_loop, _batch_queue, _batch_worker
+    if _batch_worker is not None and _batch_loop is asyncio.get_running_loop():
+        _batch_worker.cancel()
+        try:
+            await _batch_worker
+        except asyncio.CancelledError:
+            pass
+    _batch_loop = _batch_queue = _batch_worker = None
+
+
+async def _submit_to_batcher(hostname: str, mac_address: str, LLA: str) -> dict:
+    """
+    Queue an LLA validation for the micro-batcher and wait for its result.
     
     Args:
         hostname: Owner/hostname (e.g., "f4d_test")
@@ -36,17 +265,126 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
         LLA: LLA value to validate (e.g., "fd002124b00ccf7399b")
     
     Returns:
-        dict: Validation result with keys:
-            - is_valid (bool): True if LLA found (count >= 1), False otherwise
+        dict: Validation result (see _validate_lla_group)
+    """
+    queue = _ensure_batcher()
+    future = asyncio.get_running_loop().create_future()
+    await queue.put(((hostname, mac_address, LLA), future))
+    
+    try:
+        return await asyncio.wait_for(future, BATCH_RESULT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        error_msg = f"Validation timed out after {BATCH_RESULT_TIMEOUT_SECONDS}s"
+    except Exception as e:
+        error_msg = f"Error validating LLA: {str(e)}"
+    
+    logger.error(
+        f"[VALIDATE_SENSOR_LLA] Batched validation failed | "
+        f"Hostname: {hostname} | "
+        f"MAC: {mac_address} | "
+        f"LLA: {LLA} | "
+        f"Error: {error_msg}"
+    )
+    return {
+        "is_valid": False,
+        "message": "Validation failed",
+        "error": error_msg
+    }
+
+
+def _fail_entries(entries, error: BaseException):
+    """Resolve the futures of queued validations with an exception."""
+    for _, future in entries:
+        if not future.done():
+            future.set_exception(error)
+
+
+async def _run_batcher(queue: asyncio.Queue):
+    """
+    Drain queued validations in batches of up to BATCH_MAX, waiting at most
+    BATCH_WAIT_MS for a batch to fill, and resolve them with one query per metadata table.
+    If the worker stops for any reason, every validation it still holds or that is
+    still queued is failed instead of left waiting.
+    """
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + BATCH_WAIT_MS / 1000
+            while len(batch) < BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Group by (hostname, mac_address) - each group reads the same metadata table
+            groups = defaultdict(list)
+            for (hostname, mac_address, LLA), future in batch:
+                groups[(hostname, mac_address)].append((LLA, future))
+            
+            # Resolve groups in the background so the next batch can be collected meanwhile
+            for (hostname, mac_address), entries in groups.items():
+                task = asyncio.create_task(_resolve_batch_group(hostname, mac_address, entries))
+                _batch_tasks.add(task)
+                task.add_done_callback(_batch_tasks.discard)
+            batch = []
+    except BaseException as e:
+        if not isinstance(e, asyncio.CancelledError):
+            logger.error(
+                f"[VALIDATE_SENSOR_LLA] Batcher stopped | "
+                f"Error: {str(e)}",
+                exc_info=True
+            )
+        error = RuntimeError("LLA validation batcher stopped")
+        pending = batch
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        _fail_entries(pending, error)
+        # Errors are logged above; only re-raise cancellation and interpreter exits
+        if not isinstance(e, Exception):
+            raise
+
+
+async def _resolve_batch_group(hostname: str, mac_address: str, entries: list):
+    """Validate one group of batched LLAs in a worker thread and resolve their futures."""
+    try:
+        results = await asyncio.to_thread(
+            _validate_lla_group, hostname, mac_address, [LLA for LLA, _ in entries]
+        )
+    except Exception as e:
+        _fail_entries(entries, e)
+        return
+    for LLA, future in entries:
+        if not future.done():
+            future.set_result(dict(results[LLA]))
+
+
+def _validate_lla_group(hostname: str, mac_address: str, llas: list) -> dict:
+    """
+    Check which LLAs exist in the metadata table for the given hostname and MAC address.
+    
+    Args:
+        hostname: Owner/hostname (e.g., "f4d_test")
+        mac_address: MAC address (e.g., "aaaaaaaaaaaa")
+        llas: LLA values to validate (e.g., ["fd002124b00ccf7399b"])
+    
+    Returns:
+        dict: Validation result per LLA, each with keys:
+            - is_valid (bool): True if LLA found in at least one record, False otherwise
             - message (str): Human-readable message
             - error (str or None): Error message if validation failed
     """
     operation_start = time.time()
+    llas = list(dict.fromkeys(llas))
     logger.info(
         f"[VALIDATE_SENSOR_LLA] Starting validation | "
         f"Hostname: {hostname} | "
         f"MAC: {mac_address} | "
-        f"LLA: {LLA}"
+        f"LLAs: {', '.join(map(str, llas))}"
     )
     
     # Construct table name: {mac_address}_metadata
@@ -56,7 +394,16 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
     dataset = hostname
     
     # Construct full table identifier: project.dataset.table
-    full_table_name = f"{PROJECT_ID}.{dataset}.{table_name}"
+    try:
+        full_table_name = _full_table_name(dataset, table_name)
+    except ValueError as e:
+        logger.warning(f"[VALIDATE_SENSOR_LLA] {str(e)}")
+        result = {
+            "is_valid": False,
+            "message": "Validation failed",
+            "error": str(e)
+        }
+        return {LLA: dict(result) for LLA in llas}
     
     try:
         # Get client
@@ -70,66 +417,81 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
             f"Table: {full_table_name}"
         )
         
-        # Construct query - use parameterized query to prevent SQL injection
-        query = """
-        SELECT COUNT(*) as count
-        FROM `{full_table_name}`
-        WHERE Owner = @hostname
-          AND Mac_Address = @mac_address
-          AND LLA = @LLA
-        """.format(full_table_name=full_table_name)
+        # Skip the query for tables that were recently found to be missing
+        if _table_known_missing(full_table_name):
+            raise NotFound(f"Table {full_table_name} was not found (cached)")
         
-        # Use query parameters for safety
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("hostname", "STRING", hostname),
-                bigquery.ScalarQueryParameter("mac_address", "STRING", mac_address),
-                bigquery.ScalarQueryParameter("LLA", "STRING", LLA),
-            ]
-        )
-        
-        # Execute query
         query_start = time.time()
-        query_job = client.query(query, job_config=job_config)
-        results = query_job.result()
+        if len(llas) == 1:
+            # Construct query - use parameterized query to prevent SQL injection
+            query = _sql_for(_VALIDATE_LLA_SQL_TMPL, full_table_name)
+            
+            # Use query parameters for safety
+            job_config = bigquery.QueryJobConfig(
+                use_query_cache=True,
+                use_legacy_sql=False,
+                query_parameters=[
+                    bigquery.ScalarQueryParameter("hostname", "STRING", hostname),
+                    bigquery.ScalarQueryParameter("mac_address", "STRING", mac_address),
+                    bigquery.ScalarQueryParameter("LLA", "STRING", llas[0]),
+                ]
+            )
+            
+            # Execute query
+            query_job = client.query(query, job_config=job_config)
+            
+            # EXISTS returns exactly one row - fetch a single-row page instead of a default page
+            results = query_job.result(max_results=1, page_size=1)
+            found = set(llas) if next(iter(results)).has_match else set()
+        else:
+            # Several LLAs for the same table - resolve them all with one query
+            query = _sql_for(_VALIDATE_LLAS_SQL_TMPL, full_table_name)
+            
+            # Use query parameters for safety
+            job_config = bigquery.QueryJobConfig(
+                use_query_cache=True,
+                use_legacy_sql=False,
+                query_parameters=[
+                    bigquery.ScalarQueryParameter("hostname", "STRING", hostname),
+                    bigquery.ScalarQueryParameter("mac_address", "STRING", mac_address),
+                    bigquery.ArrayQueryParameter("llas", "STRING", llas),
+                ]
+            )
+            
+            # Execute query
+            query_job = client.query(query, job_config=job_config)
+            found = {row.LLA for row in query_job.result()}
         query_duration = time.time() - query_start
         
-        # Get count
-        row = next(results)
-        count = row.count
-        
         total_duration = time.time() - operation_start
+        logger.info(
+            f"[VALIDATE_SENSOR_LLA] Validation completed | "
+            f"Found: {len(found)}/{len(llas)} | "
+            f"Query duration: {query_duration:.3f}s | "
+            f"Total duration: {total_duration:.3f}s"
+        )
         
-        if count >= 1:
-            # LLA found in metadata (may exist in multiple historical records)
-            result_message = f"LLA found in metadata (exists in {count} record(s))" if count > 1 else "LLA found in metadata"
-            logger.info(
-                f"[VALIDATE_SENSOR_LLA] Validation successful | "
-                f"Count: {count} | "
-                f"Query duration: {query_duration:.3f}s | "
-                f"Total duration: {total_duration:.3f}s"
-            )
-            return {
-                "is_valid": True,
-                "message": result_message,
-                "error": None
-            }
-        else:
-            # LLA not found
-            logger.info(
-                f"[VALIDATE_SENSOR_LLA] Validation failed - LLA not found | "
-                f"Count: {count} | "
-                f"Query duration: {query_duration:.3f}s | "
-                f"Total duration: {total_duration:.3f}s"
-            )
-            return {
-                "is_valid": False,
-                "message": "LLA not found in metadata",
-                "error": None
-            }
+        results = {}
+        for LLA in llas:
+            if LLA in found:
+                # LLA found in metadata (may exist in multiple historical records)
+                results[LLA] = {
+                    "is_valid": True,
+                    "message": "LLA found in metadata",
+                    "error": None
+                }
+            else:
+                # LLA not found
+                results[LLA] = {
+                    "is_valid": False,
+                    "message": "LLA not found in metadata",
+                    "error": None
+                }
+        return results
     
     except NotFound as e:
         # Table not found - this is a valid case (table doesn't exist for this MAC address)
+        _mark_table_missing(full_table_name)
         error_msg = f"Metadata table not found: {full_table_name}"
         total_duration = time.time() - operation_start
         logger.warning(
@@ -139,7 +501,7 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
             f"MAC: {mac_address} | "
             f"Duration: {total_duration:.3f}s"
         )
-        return {
+        result = {
             "is_valid": False,
             "message": f"Metadata table not found for MAC address: {mac_address}",
             "error": error_msg
@@ -153,7 +515,7 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
             f"Duration: {total_duration:.3f}s",
             exc_info=True
         )
-        return {
+        result = {
             "is_valid": False,
             "message": "Validation failed",
             "error": error_msg
@@ -167,11 +529,114 @@ async def validate_sensor_lla(hostname: str, mac_address: str, LLA: str) -> dict
             f"Duration: {total_duration:.3f}s",
             exc_info=True
         )
-        return {
+        result = {
             "is_valid": False,
             "message": "Validation failed",
             "error": error_msg
         }
+    
+    return {LLA: dict(result) for LLA in llas}
+
+
+def _rows_to_dicts(query_job) -> list:
+    """
+    Convert query results to a list of dictionaries.
+    
+    Results are downloaded through the Storage Read API and converted by Arrow when
+    available. Otherwise rows are read over REST, looking up the column names once
+    instead of once per row. The REST path is also used when the service account
+    is not allowed to create Storage API read sessions.
+    
+    Args:
+        query_job: BigQuery query job
+    
+    Returns:
+        list: One dictionary per result row
+    """
+    bqstorage_client = get_bqstorage_client()
+    if bqstorage_client is not None:
+        try:
+            return query_job.to_arrow(bqstorage_client=bqstorage_client).to_pylist()
+        except (PermissionDenied, Forbidden) as e:
+            # Missing bigquery.readsessions.create - the REST path needs no extra role
+            logger.warning(
+                f"[ROWS_TO_DICTS] Storage Read API not permitted, falling back to REST | "
+                f"Error: {str(e)}"
+            )
+    
+    results = query_job.result()
+    field_names = [field.name for field in results.schema]
+    return [dict(zip(field_names, row.values())) for row in results]
+
+
+# orjson options shared by every encoder of query rows
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _json_default(value):
+    """
+    Serialize BigQuery values that orjson does not handle natively,
+    matching FastAPI's jsonable_encoder output for them.
+    """
+    if isinstance(value, Decimal):
+        # Integral NUMERIC values stay integers, like FastAPI's decimal_encoder
+        if value.as_tuple().exponent >= 0:
+            return int(value)
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class BigQueryJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also encodes the Decimal and bytes values BigQuery returns."""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_json_default, option=_ORJSON_OPTIONS)
+
+
+def _stream_rows_as_json(header: dict, results):
+    """
+    Yield a JSON document made of the header fields followed by a "data" array,
+    encoding the result rows one page at a time.
+    
+    The HTTP status is already sent when the rows are read, so a failure on a
+    later page is logged and ends the stream, leaving the JSON document truncated.
+    
+    Args:
+        header: Response fields written before the rows
+        results: RowIterator of the query results
+    """
+    stream_start = time.time()
+    field_names = [field.name for field in results.schema]
+    
+    # Reopen the encoded header object to append the data array
+    yield orjson.dumps(header, option=_ORJSON_OPTIONS)[:-1] + b',"data":['
+    
+    rows_sent = 0
+    separator = b""
+    try:
+        for page in results.pages:
+            encoded_rows = [
+                orjson.dumps(dict(zip(field_names, row.values())), default=_json_default, option=_ORJSON_OPTIONS)
+                for row in page
+            ]
+            if encoded_rows:
+                yield separator + b",".join(encoded_rows)
+                separator = b","
+                rows_sent += len(encoded_rows)
+    except Exception as e:
+        logger.error(
+            f"[QUERY_METADATA_TABLE] Streaming failed, response truncated | "
+            f"Table: {header.get('full_table')} | "
+            f"Rows sent: {rows_sent} | "
+            f"Error: {str(e)} | "
+            f"Duration: {time.time() - stream_start:.3f}s",
+            exc_info=True
+        )
+        raise
+    
+    yield b"]}"
 
 
 @router.get("/GCP-BQ/metadata")
@@ -191,36 +656,40 @@ async def query_metadata_table(
         offset: Number of rows to skip (default: 0)
     
     Returns:
-        dict: Query results with metadata in JSON format
+        StreamingResponse: Query results with metadata in JSON format.
+        Rows are fetched and sent one page at a time, so the response starts
+        before the whole result set is read and is never held in memory at once.
     
     Example:
         GET /bq/metadata?dataset=f4d_test&table=aaaaaaaaaaaa_metadata&limit=50
     """
+    # Construct full table identifier: project.dataset.table
+    try:
+        full_table_name = _full_table_name(dataset, table)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         client = get_client()
+        logger.debug("[QUERY_METADATA_TABLE] Full table name: %s", full_table_name)
         
-        # Construct full table identifier: project.dataset.table
-        full_table_name = f"{PROJECT_ID}.{dataset}.{table}"
-        print(f"Full table name: {full_table_name}")
-        
-        # Construct query
-        query = f"""
-        SELECT *
-        FROM `{full_table_name}`
-        LIMIT {limit}
-        OFFSET {offset}
-        """
-        
-        # Execute query
-        query_job = client.query(query)
-        results = query_job.result()
+        # Construct query - only the table identifier varies, paging uses query parameters
+        query = _sql_for(_METADATA_PAGE_SQL_TMPL, full_table_name)
+        job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+            use_legacy_sql=False,
+            query_parameters=[
+                bigquery.ScalarQueryParameter("limit", "INT64", limit),
+                bigquery.ScalarQueryParameter("offset", "INT64", offset),
+            ]
+        )
         
-        # Convert results to list of dictionaries
-        rows = []
-        for row in results:
-            rows.append(dict(row))
+        # Execute query - wait for the job here so query errors still map to HTTP errors
+        # The BigQuery client is blocking - run it in a worker thread to keep the event loop free
+        query_job = await asyncio.to_thread(client.query, query, job_config=job_config)
+        results = await asyncio.to_thread(query_job.result, page_size=STREAM_PAGE_SIZE)
         
-        return {
+        header = {
             "success": True,
             "project": PROJECT_ID,
             "dataset": dataset,
@@ -228,9 +697,12 @@ async def query_metadata_table(
             "full_table": full_table_name,
             "limit": limit,
             "offset": offset,
-            "count": len(rows),
-            "data": rows
+            "count": results.total_rows,
         }
+        return StreamingResponse(
+            _stream_rows_as_json(header, results),
+            media_type="application/json"
+        )
     
     except GoogleCloudError as e:
         raise HTTPException(status_code=500, detail=f"BigQuery error: {str(e)}")
@@ -238,6 +710,37 @@ async def query_metadata_table(
         raise HTTPException(status_code=500, detail=f"Error querying table: {str(e)}")
 
 
+@functools.lru_cache(maxsize=None)
+def _active_metadata_query_shape(has_lla: bool, has_experiment: bool) -> tuple:
+    """
+    Build the active metadata query template for a combination of filters.
+    
+    Args:
+        has_lla: Filter by LLA
+        has_experiment: Filter by Exp_ID and Exp_Name
+    
+    Returns:
+        tuple: (SQL template with a {table} placeholder and positional ? parameters,
+                tuple of the parameter types in placeholder order)
+    """
+    conditions = ["Owner = ?", "Mac_Address = ?"]
+    param_types = ["STRING", "STRING"]
+    if has_lla:
+        conditions.append("LLA = ?")
+        param_types.append("STRING")
+    if has_experiment:
+        conditions.append("Exp_ID = ? AND Exp_Name = ?")
+        param_types.extend(["INT64", "STRING"])
+    
+    template = (
+        "\nSELECT *\n"
+        "FROM `{table}`\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        "ORDER BY Exp_ID, Exp_Name, LLA\n"
+    )
+    return template, tuple(param_types)
+
+
 @router.get("/GCP-BQ/metadata/active")
 async def query_active_metadata(
     hostname: str,
@@ -257,7 +760,7 @@ async def query_active_metadata(
         all: If True, return all metadata for the mac_address (ignores lla and experiment)
     
     Returns:
-        dict: Query results with metadata in JSON format (all metadata, not filtered by Active_Exp)
+        BigQueryJSONResponse: Query results with metadata in JSON format (all metadata, not filtered by Active_Exp)
     
     Example:
         GET /GCP-BQ/metadata/active?hostname=f4d_test&mac_address=aaaaaaaaaaaa&lla=fd002124b00ccf7399b
@@ -281,69 +784,67 @@ async def query_active_metadata(
     dataset = hostname
     
     # Construct full table identifier: project.dataset.table
-    full_table_name = f"{PROJECT_ID}.{dataset}.{table_name}"
+    try:
+        full_table_name = _full_table_name(dataset, table_name)
+    except ValueError as e:
+        logger.warning(f"[QUERY_ACTIVE_METADATA] {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
         # Get client
         client = get_client()
         
-        # Build query conditions
-        conditions = [
-            "Owner = @hostname",
-            "Mac_Address = @mac_address"
-        ]
-        
-        # Build query parameters
-        query_parameters = [
-            bigquery.ScalarQueryParameter("hostname", "STRING", hostname),
-            bigquery.ScalarQueryParameter("mac_address", "STRING", mac_address),
-        ]
-        
-        # Add LLA filter if provided and not querying all
-        if lla and not all:
-            conditions.append("LLA = @lla")
-            query_parameters.append(bigquery.ScalarQueryParameter("lla", "STRING", lla))
-        
-        # Add experiment filter if provided and not querying all
+        # Parse experiment filter if provided and not querying all
+        experiment_values = None
         if experiment and not all:
             # Parse experiment format: "Exp_ID_Exp_Name"
             try:
                 parts = experiment.split("_", 1)
                 if len(parts) == 2:
                     exp_id_str, exp_name = parts
-                    exp_id = int(exp_id_str)
-                    conditions.append("Exp_ID = @exp_id AND Exp_Name = @exp_name")
-                    query_parameters.append(bigquery.ScalarQueryParameter("exp_id", "INT64", exp_id))
-                    query_parameters.append(bigquery.ScalarQueryParameter("exp_name", "STRING", exp_name))
+                    experiment_values = (int(exp_id_str), exp_name)
                 else:
                     logger.warning(f"[QUERY_ACTIVE_METADATA] Invalid experiment format: {experiment}")
             except ValueError as e:
                 logger.warning(f"[QUERY_ACTIVE_METADATA] Error parsing experiment ID: {e}")
         
+        # Add LLA filter if provided and not querying all
+        has_lla = bool(lla) and not all
+        
         # Construct query - return all metadata (no Active_Exp filtering in backend)
-        where_clause = " AND ".join(conditions)
-        query = f"""
-        SELECT *
-        FROM `{full_table_name}`
-        WHERE {where_clause}
-        ORDER BY Exp_ID, Exp_Name, LLA
-        """
+        template, param_types = _active_metadata_query_shape(has_lla, experiment_values is not None)
+        query = _sql_for(template, full_table_name)
+        
+        # Build positional query parameters in the order of the template's placeholders
+        values = [hostname, mac_address]
+        if has_lla:
+            values.append(lla)
+        if experiment_values is not None:
+            values.extend(experiment_values)
+        query_parameters = [
+            bigquery.ScalarQueryParameter.positional(param_type, value)
+            for param_type, value in zip(param_types, values)
+        ]
         
         # Use query parameters for safety
         job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+            use_legacy_sql=False,
             query_parameters=query_parameters
         )
         
+        # Skip the query for tables that were recently found to be missing
+        if _table_known_missing(full_table_name):
+            raise NotFound(f"Table {full_table_name} was not found (cached)")
+        
         # Execute query
         query_start = time.time()
-        query_job = client.query(query, job_config=job_config)
-        results = query_job.result()
-        query_duration = time.time() - query_start
+        # The BigQuery client is blocking - run it in a worker thread to keep the event loop free
+        query_job = await asyncio.to_thread(client.query, query, job_config=job_config)
         
         # Convert results to list of dictionaries
-        rows = []
-        for row in results:
-            rows.append(dict(row))
+        rows = await asyncio.to_thread(_rows_to_dicts, query_job)
+        query_duration = time.time() - query_start
         
         total_duration = time.time() - operation_start
         
@@ -354,7 +855,7 @@ async def query_active_metadata(
             f"Total duration: {total_duration:.3f}s"
         )
         
-        return {
+        return BigQueryJSONResponse(content={
             "success": True,
             "project": PROJECT_ID,
             "dataset": dataset,
@@ -362,9 +863,10 @@ async def query_active_metadata(
             "full_table": full_table_name,
             "count": len(rows),
             "data": rows
-        }
+        })
     
     except NotFound as e:
+        _mark_table_missing(full_table_name)
         error_msg = f"Metadata table not found: {full_table_name}"
         total_duration = time.time() - operation_start
         logger.warning(
@@ -394,4 +896,31 @@ async def query_active_metadata(
             f"Duration: {total_duration:.3f}s",
             exc_info=True
         )
-        raise HTTPException(status_code=500, detail=error_msg)
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@router.post("/GCP-BQ/cache/clear")
+async def clear_caches():
+    """
+    Clear the cached missing tables and LLA validation results,
+    e.g. after creating a metadata table or adding sensors.
+    
+    Returns:
+        dict: Number of entries removed from each cache
+    """
+    with _table_missing_lock:
+        tables_cleared = len(_table_missing_cache)
+        _table_missing_cache.clear()
+    llas_cleared = len(_lla_cache)
+    _lla_cache.clear()
+    
+    logger.info(
+        f"[CLEAR_CACHES] Caches cleared | "
+        f"Tables: {tables_cleared} | "
+        f"LLAs: {llas_cleared}"
+    )
+    return {
+        "success": True,
+        "tables_cleared": tables_cleared,
+        "llas_cleared": llas_cleared
+    }
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -17,7 +18,7 @@ from .api.get_endpoints import router as get_router
 from .api.bigquery_endpoints import router as bq_router
 from .api.websocket_endpoints import websocket_ping
 
-app = FastAPI(title="ApiSync", version="1.0.0")
+app = FastAPI(title="ApiSync", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(